@@ -8,12 +8,13 @@ eine separate CSV mit Monats‑Klimamitteln über den Zeitraum (50 Jahre).
 Voraussetzungen:
  - Konto beim Copernicus Climate Data Store (CDS) und cdsapi konfiguriert (~/.cdsapirc)
  - Python 3.8+
- - Pakete: cdsapi, xarray, netCDF4, pandas, numpy
-   Installation: pip install cdsapi xarray netCDF4 pandas numpy
+ - Pakete: cdsapi, xarray, netCDF4, dask, pandas, numpy, pyarrow
+   Installation: pip install cdsapi xarray netCDF4 dask pandas numpy pyarrow
 
 Hinweis: Dieses Skript fordert Daten per CDS-API an. Bei großen Zeiträumen
-kann das Resultat als NetCDF mehrere MB bis GB groß werden. Bei Bedarf den
-Zeitraum in Abschnitten herunterladen.
+kann das Resultat als NetCDF mehrere MB bis GB groß werden. Der Zeitraum wird
+daher jahresweise angefordert (bis zu 4 Anfragen parallel) und jedes Jahr
+einzeln im Verzeichnis cache/ abgelegt.
 
 Quelle: ERA5 monthly means (Copernicus Climate Data Store)
 https://cds.climate.copernicus.eu/datasets/reanalysis-era5-single-levels-monthly-means
@@ -26,6 +27,9 @@ import numpy as np
 import os
 import zipfile
 import glob
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # === Benutzer-Parameter ===
 # Koordinaten Santander / Parayas (etwa)
@@ -39,70 +43,150 @@ months = [f"{m:02d}" for m in range(1,13)]
 # Kleines Gebiet um Santander: [north, west, south, east]
 area = [43.6, -4.0, 43.2, -3.6]
 
+# Maximale Anzahl gleichzeitiger CDS-Anfragen (Fair-Use: nicht mehr als 4)
+max_workers = 4
+
 # Output-Dateien
 out_nc = 'era5_santander_1975_2024_monthly.nc'
 out_csv = 'era5_santander_1975_2024_monthly.csv'
 clim_csv = 'era5_santander_1975_2024_monthly_climatology.csv'
+# Parquet: typisiert und spaltenweise komprimiert, für das schnelle Einlesen
+# in visualize_climate_data.py (die CSVs bleiben als lesbare Ausgabe erhalten)
+out_parquet = out_csv.replace('.csv', '.parquet')
+clim_parquet = clim_csv.replace('.csv', '.parquet')
 
-# === 1) Daten über CDS anfordern (falls NetCDF noch nicht existiert) ===
-if not os.path.exists(out_nc):
-    c = cdsapi.Client()
-    print('Starte Datenanforderung an CDS... (dies kann einige Minuten dauern)')
-    c.retrieve(
-        'reanalysis-era5-single-levels-monthly-means',
-        {
-            'product_type':'monthly_averaged_reanalysis',
-            'variable':['2m_temperature','total_precipitation'],
-            'year': years,
-            'month': months,
-            'time': '00:00',
-            'area': area,
-            'format':'netcdf',
-        },
-        out_nc)
-    print('Download abgeschlossen:', out_nc)
-else:
-    print('NetCDF bereits vorhanden, überspringe Download:', out_nc)
+# Cache-Verzeichnis für heruntergeladene NetCDF-Dateien (Schlüssel: Hash der Anfrage)
+cache_dir = 'cache'
 
-# === 2) NetCDF laden und an Punkt extrahieren ===
-print('Lade NetCDF mit xarray...')
+# === 1) Daten über CDS anfordern (falls nicht bereits im Cache) ===
+# Der Cache-Schlüssel ist ein Hash über die jeweilige Anfrage. Ändern sich
+# Gebiet, Jahre oder Variablen, wird neu heruntergeladen statt alte Daten
+# wiederzuverwenden.
+dataset = 'reanalysis-era5-single-levels-monthly-means'
+request = {
+    'product_type':'monthly_averaged_reanalysis',
+    'variable':['2m_temperature','total_precipitation'],
+    'year': years,
+    'month': months,
+    'time': '00:00',
+    'area': area,
+    'format':'netcdf',
+}
 
-# Prüfe, ob die Originaldatei ein ZIP-Archiv ist und extrahiere bei Bedarf
-import zipfile
-if zipfile.is_zipfile(out_nc):
-    print('Datei ist ein ZIP-Archiv, extrahiere NetCDF-Dateien...')
-    with zipfile.ZipFile(out_nc, 'r') as zip_ref:
-        zip_ref.extractall('.')
-    
-    # Suche nach den extrahierten NetCDF-Dateien
-    import glob
-    nc_files = glob.glob('data_stream-*.nc')
-    
-    if len(nc_files) == 2:
-        # Lade beide Dateien
-        ds1 = xr.open_dataset(nc_files[0])
-        ds2 = xr.open_dataset(nc_files[1])
-        
-        # Bestimme, welche Datei welche Variable enthält
-        if 't2m' in ds1.data_vars:
-            ds_temp = ds1
-            ds_precip = ds2
-        else:
-            ds_temp = ds2
-            ds_precip = ds1
-            
-        print('Zwei separate NetCDF-Dateien geladen (Temperatur und Niederschlag)')
+def _request_key(req_dict):
+    """Stabiler Hash-Schlüssel einer CDS-Anfrage (unabhängig von der Schlüsselreihenfolge)."""
+    payload = json.dumps(req_dict, sort_keys=True).encode('utf-8')
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def _cache_path(req_dict):
+    """Pfad des Cache-Eintrags für eine einzelne CDS-Anfrage."""
+    return os.path.join(cache_dir, _request_key({'dataset': dataset, **req_dict}) + '.nc')
+
+def _retrieve(req_dict):
+    """Lädt eine CDS-Anfrage in ihren Cache-Eintrag herunter."""
+    path = _cache_path(req_dict)
+    # Erst in eine temporäre Datei laden, damit ein abgebrochener Download
+    # keinen unvollständigen Cache-Eintrag hinterlässt
+    cdsapi.Client().retrieve(dataset, req_dict, path + '.part')
+    os.replace(path + '.part', path)
+    print('Download abgeschlossen:', path)
+    return path
+
+# Die zusammengeführte, zeitlich umgechunkte Datei ist unter dem Schlüssel
+# der Gesamtanfrage abgelegt; out_nc zeigt auf diesen Cache-Eintrag.
+merged_nc = os.path.splitext(_cache_path(request))[0] + '_merged.nc'
+
+if not os.path.exists(merged_nc):
+    # Eine Anfrage pro Jahr: die Wartezeit in der CDS-Queue überlappt sich so,
+    # statt dass 50 Jahre in einer einzigen Anfrage nacheinander verarbeitet werden
+    per_year_requests = [dict(request, year=[y]) for y in years]
+    parts = [_cache_path(r) for r in per_year_requests]
+    missing = [r for r, part in zip(per_year_requests, parts) if not os.path.exists(part)]
+
+    if missing:
+        os.makedirs(cache_dir, exist_ok=True)
+        print(f'Starte {len(missing)} Datenanforderungen an CDS (max. {max_workers} parallel)... '
+              '(dies kann einige Minuten dauern)')
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(_retrieve, missing))
     else:
-        raise ValueError(f"Unerwartete Anzahl von NetCDF-Dateien gefunden: {len(nc_files)}")
+        print('Alle Jahre bereits im Cache, überspringe Download')
+
+    # === 2) Teildateien zusammenführen und entlang der Zeit umchunken ===
+    print('Führe Jahresdateien zusammen...')
+
+    # Jede Teildatei ist entweder eine NetCDF-Datei oder ein ZIP-Archiv mit je
+    # einer Datei pro Datenstrom (Temperatur und Niederschlag getrennt).
+    # ZIP-Archive werden neben den Cache-Eintrag entpackt und die Dateien
+    # nach Datenstrom gruppiert, damit jeder Strom über alle Jahre geladen wird.
+    streams = {}
+    for part in parts:
+        if zipfile.is_zipfile(part):
+            extract_dir = os.path.splitext(part)[0]
+            with zipfile.ZipFile(part, 'r') as zip_ref:
+                zip_ref.extractall(extract_dir)
+            for nc_file in glob.glob(os.path.join(extract_dir, 'data_stream-*.nc')):
+                streams.setdefault(os.path.basename(nc_file), []).append(nc_file)
+        else:
+            streams.setdefault(None, []).append(part)
+
+    datasets = [xr.open_mfdataset(sorted(files), engine='netcdf4',
+                                  combine='by_coords', parallel=True)
+                for files in streams.values()]
+    merged = xr.merge(datasets, compat='override').drop_encoding()
+
+    # ERA5 liefert die Daten zeitschrittweise gechunkt, d.h. die Zeitreihe
+    # eines Punktes verteilt sich auf einen Chunk pro Monat. Hier wird einmalig
+    # mit der kompletten Zeitachse je Gitterpunkt als einem Chunk geschrieben.
+    encoding = {
+        name: {
+            'zlib': True,
+            'complevel': 1,
+            'chunksizes': tuple(1 if dim in ('latitude', 'longitude') else merged.sizes[dim]
+                                for dim in var.dims),
+        }
+        for name, var in merged.data_vars.items()
+        if 'latitude' in var.dims and 'longitude' in var.dims
+    }
+    merged.to_netcdf(merged_nc + '.part', encoding=encoding)
+    os.replace(merged_nc + '.part', merged_nc)
+    print('Zusammengeführte NetCDF gespeichert:', merged_nc)
 else:
-    # Originale Methode für einzelne NetCDF-Datei
-    ds = xr.open_dataset(out_nc)
-    ds_temp = ds
-    ds_precip = ds
+    print('Anfrage bereits im Cache, überspringe Download:', merged_nc)
 
-# Wähle nächstgelegenen Gitternetzpunkt für beide Datensätze
-pt_temp = ds_temp.sel(latitude=lat_pt, longitude=lon_pt, method='nearest')
-pt_precip = ds_precip.sel(latitude=lat_pt, longitude=lon_pt, method='nearest')
+# Eine vorhandene reguläre Datei unter out_nc (z.B. ein früherer Download)
+# wird nicht angetastet; nur ein von diesem Skript angelegter Symlink wird ersetzt.
+if os.path.exists(out_nc) and not os.path.islink(out_nc):
+    print(f'{out_nc} ist eine reguläre Datei und bleibt unverändert, '
+          'verwende Cache-Datei direkt:', merged_nc)
+    out_nc = merged_nc
+else:
+    if os.path.islink(out_nc):
+        os.remove(out_nc)
+    try:
+        os.symlink(merged_nc, out_nc)
+    except OSError:
+        # z.B. Windows ohne Symlink-Berechtigung: direkt mit der Cache-Datei arbeiten
+        print('Symlink nicht möglich, verwende Cache-Datei direkt:', merged_nc)
+        out_nc = merged_nc
+
+# === 3) NetCDF laden und an Punkt extrahieren ===
+print('Lade NetCDF mit xarray...')
+
+# Lazy mit dask laden: ein Chunk pro Gitterpunkt, entlang der Zeit die
+# Chunkgröße der Datei (nach dem Umchunken die gesamte Zeitreihe). So liest
+# .values später nur die Zeitreihe des gewählten Punktes in einem Zugriff.
+point_chunks = {'latitude': 1, 'longitude': 1}
+ds = xr.open_dataset(out_nc, chunks=point_chunks, engine='netcdf4')
+ds_temp = ds
+ds_precip = ds
+
+# Wähle nächstgelegenen Gitternetzpunkt: Indizes einmal bestimmen und für
+# beide Variablen per isel verwenden (gleiches Gitter)
+i = int(np.abs(ds.latitude.values - lat_pt).argmin())
+j = int(np.abs(ds.longitude.values - lon_pt).argmin())
+pt_temp = ds_temp.isel(latitude=i, longitude=j)
+pt_precip = ds_precip.isel(latitude=i, longitude=j)
 
 # Extrahiere Zeit, Temp und Precip
 # Bestimme den Namen der Zeitdimension (kann 'time' oder 'valid_time' sein)
@@ -119,38 +203,57 @@ t2m = pt_temp[temp_var].values  # Kelvin
 # Niederschlag (in meters)
 precip = pt_precip[precip_var].values  # meters
 
-# Einheitstransformation
+# Einheitstransformation (in-place, die Rohwerte werden danach nicht mehr gebraucht)
+if not t2m.flags.writeable:
+    t2m = t2m.copy()
+if not precip.flags.writeable:
+    precip = precip.copy()
 # Temperatur: K -> °C
-t2m_c = t2m - 273.15
+t2m_c = np.subtract(t2m, 273.15, out=t2m)
 # Niederschlag: m -> mm
-precip_mm = precip * 1000.0
+precip_mm = np.multiply(precip, 1000.0, out=precip)
 
-# === 3) DataFrame aufbauen ===
-# Zeit in Jahr/Monat aufsplitten
-timestamps = pd.to_datetime(time)
-years_col = timestamps.year
-months_col = timestamps.month
+# === 4) DataFrame aufbauen ===
+# Zeit in Jahr/Monat aufsplitten (direkt über datetime64-Casts, ohne
+# Umweg über einen pandas DatetimeIndex)
+years_col = time.astype('datetime64[Y]').astype(int) + 1970
+months_col = time.astype('datetime64[M]').astype(int) % 12 + 1
 
 df = pd.DataFrame({
     'year': years_col,
     'month': months_col,
-    't2m_mean_C': t2m_c,
-    'precip_total_mm': precip_mm,
+    't2m_mean_C': t2m_c.astype(np.float32, copy=False),
+    'precip_total_mm': precip_mm.astype(np.float32, copy=False),
 })
 
 # Sortieren
 df = df.sort_values(['year','month']).reset_index(drop=True)
 
 # Speichere die Monatsdaten
-df.to_csv(out_csv, index=False)
-print('Monatliche Daten gespeichert:', out_csv)
+df.to_csv(out_csv, index=False, float_format='%.4f')
+df.to_parquet(out_parquet, compression='zstd', index=False)
+print('Monatliche Daten gespeichert:', out_csv, out_parquet)
 
-# === 4) Klimamittel (Monatsweise über den Zeitraum) ===
-clim = df.groupby('month')[['t2m_mean_C','precip_total_mm']].mean().reset_index()
-clim.to_csv(clim_csv, index=False)
-print('Monatliche Klimamittel (1975-2024) gespeichert:', clim_csv)
+# === 5) Klimamittel (Monatsweise über den Zeitraum) ===
+# 12 feste Gruppen: Summen und Anzahlen je Monat direkt per np.bincount
+def _monthly_mean(values):
+    """Mittel je Monat (1-12); fehlende Werte werden wie bei groupby().mean() übersprungen."""
+    valid = ~np.isnan(values)
+    counts = np.bincount(months_col[valid], minlength=13)[1:]
+    sums = np.bincount(months_col[valid], weights=values[valid], minlength=13)[1:]
+    with np.errstate(invalid='ignore'):
+        return sums / counts
+
+clim = pd.DataFrame({
+    'month': np.arange(1, 13),
+    't2m_mean_C': _monthly_mean(t2m_c).astype(np.float32),
+    'precip_total_mm': _monthly_mean(precip_mm).astype(np.float32),
+})
+clim.to_csv(clim_csv, index=False, float_format='%.4f')
+clim.to_parquet(clim_parquet, compression='zstd', index=False)
+print('Monatliche Klimamittel (1975-2024) gespeichert:', clim_csv, clim_parquet)
 
-print('Fertig. Ergebnisdateien:', out_csv, clim_csv)
+print('Fertig. Ergebnisdateien:', out_csv, clim_csv, out_parquet, clim_parquet)
 
 # === Zusatz: kurze Zusammenfassung in der Konsole ===
 print('\nKurze Vorschau:')
@@ -3,7 +3,16 @@ Visualisierung der ERA5 Klimadaten für Santander (1975-2024)
 Erstellt verschiedene Diagramme zur Analyse der Temperatur- und Niederschlagsdaten
 """
 
+import os
 import pandas as pd
+import matplotlib
+
+# Standardmäßig nur PNG-Dateien erzeugen (Agg-Backend, kein Fenster/X11 nötig).
+# Mit SHOW=1 werden die Diagramme zusätzlich interaktiv angezeigt.
+show_plots = os.environ.get('SHOW', '0') == '1'
+if not show_plots:
+    matplotlib.use('Agg')
+
 import matplotlib.pyplot as plt
 import numpy as np
 import seaborn as sns
@@ -18,12 +27,40 @@ plt.rcParams['font.family'] = 'serif'
 plt.rcParams['font.serif'] = ['Cambria', 'Times New Roman', 'DejaVu Serif', 'serif']
 plt.rcParams['font.size'] = 11
 
-# Daten laden
-monthly_data = pd.read_csv('era5_santander_1975_2024_monthly.csv')
-climate_data = pd.read_csv('era5_santander_1975_2024_monthly_climatology.csv')
+# PNG-Kompression Stufe 1: deutlich schnelleres Speichern bei 300 dpi,
+# die Dateien werden nur geringfügig größer
+png_options = {'compress_level': 1}
+
+
+def linfit(y, x=None):
+    """Lineare Regression (Steigung, Achsenabschnitt) in geschlossener Form."""
+    y = np.asarray(y, dtype=float)
+    x = np.arange(len(y)) if x is None else np.asarray(x, dtype=float)
+    xm = x.mean()
+    ym = y.mean()
+    slope = ((x - xm) * (y - ym)).sum() / ((x - xm) ** 2).sum()
+    return slope, ym - slope * xm
+
+
+def load_table(basename):
+    """Lädt eine Tabelle aus Parquet, falls vorhanden und nicht älter als die CSV, sonst aus der CSV."""
+    parquet_path = basename + '.parquet'
+    csv_path = basename + '.csv'
+    if os.path.exists(parquet_path) and (
+            not os.path.exists(csv_path)
+            or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)):
+        return pd.read_parquet(parquet_path)
+    # pyarrow-Parser, Spalten bleiben numpy-basiert für numpy/matplotlib
+    return pd.read_csv(csv_path, engine='pyarrow')
 
-# Datum-Spalte erstellen für Zeitreihen
-monthly_data['date'] = pd.to_datetime(monthly_data[['year', 'month']].assign(day=1))
+
+# Daten laden: bevorzugt die Parquet-Dateien aus climate_data.py, sonst die CSVs
+monthly_data = load_table('era5_santander_1975_2024_monthly')
+climate_data = load_table('era5_santander_1975_2024_monthly_climatology')
+
+# Datum-Spalte erstellen für Zeitreihen (reine datetime64-Arithmetik, kein Parsen)
+monthly_data['date'] = ((monthly_data['year'].to_numpy() - 1970).astype('datetime64[Y]')
+                        + (monthly_data['month'].to_numpy() - 1).astype('timedelta64[M]'))
 
 print("Erstelle Klimadiagramme für Santander...")
 
@@ -39,10 +76,12 @@ ax1.grid(True, alpha=0.3)
 ax1.set_ylim(0, 25)
 
 # Trend-Linie hinzufügen
-z = np.polyfit(range(len(monthly_data)), monthly_data['t2m_mean_C'], 1)
-p = np.poly1d(z)
-ax1.plot(monthly_data['date'], p(range(len(monthly_data))), 
-         "r--", alpha=0.8, linewidth=2, label=f'Trend: {z[0]:.3f}°C/Jahr')
+# Eine Gerade braucht nur ihre beiden Endpunkte
+date_ends = monthly_data['date'].iloc[[0, -1]]
+x_ends = np.array([0, len(monthly_data) - 1])
+slope_t, intercept_t = linfit(monthly_data['t2m_mean_C'])
+ax1.plot(date_ends, slope_t * x_ends + intercept_t, 
+         "r--", alpha=0.8, linewidth=2, label=f'Trend: {slope_t:.3f}°C/Jahr')
 ax1.legend()
 
 # Niederschlag-Zeitreihe
@@ -54,15 +93,16 @@ ax2.set_xlabel('Jahr', fontsize=12)
 ax2.grid(True, alpha=0.3)
 
 # Trend-Linie hinzufügen
-z2 = np.polyfit(range(len(monthly_data)), monthly_data['precip_total_mm'], 1)
-p2 = np.poly1d(z2)
-ax2.plot(monthly_data['date'], p2(range(len(monthly_data))), 
-         "b--", alpha=0.8, linewidth=2, label=f'Trend: {z2[0]:.3f}mm/Jahr')
+slope_p, intercept_p = linfit(monthly_data['precip_total_mm'])
+ax2.plot(date_ends, slope_p * x_ends + intercept_p, 
+         "b--", alpha=0.8, linewidth=2, label=f'Trend: {slope_p:.3f}mm/Jahr')
 ax2.legend()
 
 plt.tight_layout()
-plt.savefig('santander_zeitreihen.png', dpi=300, bbox_inches='tight')
-plt.show()
+plt.savefig('santander_zeitreihen.png', dpi=300, bbox_inches='tight', pil_kwargs=png_options)
+if show_plots:
+    plt.show()
+plt.close(fig)
 
 # === 2. Jahresgang (Klimadiagramm) ===
 fig, ax1 = plt.subplots(figsize=(12, 8))
@@ -99,8 +139,10 @@ lines2, labels2 = ax2.get_legend_handles_labels()
 ax1.legend(lines1 + lines2, labels1 + labels2, loc='upper left')
 
 plt.tight_layout()
-plt.savefig('santander_klimadiagramm.png', dpi=300, bbox_inches='tight')
-plt.show()
+plt.savefig('santander_klimadiagramm.png', dpi=300, bbox_inches='tight', pil_kwargs=png_options)
+if show_plots:
+    plt.show()
+plt.close(fig)
 
 # === 3. Jahresstatistiken ===
 annual_stats = monthly_data.groupby('year').agg({
@@ -119,11 +161,11 @@ ax1.set_xlabel('Jahr', fontsize=12)
 ax1.grid(True, alpha=0.3)
 
 # Trend
-z_annual = np.polyfit(annual_stats['year'], annual_stats['t2m_mean_C'], 1)
-p_annual = np.poly1d(z_annual)
-ax1.plot(annual_stats['year'], p_annual(annual_stats['year']), 
+slope_annual, intercept_annual = linfit(annual_stats['t2m_mean_C'], annual_stats['year'])
+year_ends = annual_stats['year'].iloc[[0, -1]]
+ax1.plot(year_ends, slope_annual * year_ends + intercept_annual, 
          "r--", alpha=0.8, linewidth=2, 
-         label=f'Trend: {z_annual[0]:.3f}°C/Jahr')
+         label=f'Trend: {slope_annual:.3f}°C/Jahr')
 ax1.legend()
 
 # Jährlicher Gesamtniederschlag
@@ -141,30 +183,36 @@ ax2.axhline(y=mean_precip, color='red', linestyle='--', linewidth=2,
 ax2.legend()
 
 plt.tight_layout()
-plt.savefig('santander_jahresstatistiken.png', dpi=300, bbox_inches='tight')
-plt.show()
+plt.savefig('santander_jahresstatistiken.png', dpi=300, bbox_inches='tight', pil_kwargs=png_options)
+if show_plots:
+    plt.show()
+plt.close(fig)
 
 # === 4. Boxplot der monatlichen Variabilität ===
 fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
 
+# Werte einmal nach Monat aufteilen und für beide Boxplots verwenden
+gb_month = monthly_data.groupby('month', sort=True)
+groups_t = [g.to_numpy() for _, g in gb_month['t2m_mean_C']]
+groups_p = [g.to_numpy() for _, g in gb_month['precip_total_mm']]
+
 # Temperatur-Boxplot
-monthly_data.boxplot(column='t2m_mean_C', by='month', ax=ax1)
+ax1.boxplot(groups_t, tick_labels=month_names)
 ax1.set_title('Monatliche Temperaturverteilung (1975-2024)', fontsize=12, fontweight='bold')
 ax1.set_ylabel('Temperatur (°C)', fontsize=12)
 ax1.set_xlabel('Monat', fontsize=12)
-ax1.set_xticklabels(month_names)
-plt.suptitle('')  # Entfernt automatischen Titel
 
 # Niederschlag-Boxplot
-monthly_data.boxplot(column='precip_total_mm', by='month', ax=ax2)
+ax2.boxplot(groups_p, tick_labels=month_names)
 ax2.set_title('Monatliche Niederschlagsverteilung (1975-2024)', fontsize=12, fontweight='bold')
 ax2.set_ylabel('Niederschlag (mm)', fontsize=12)
 ax2.set_xlabel('Monat', fontsize=12)
-ax2.set_xticklabels(month_names)
 
 plt.tight_layout()
-plt.savefig('santander_variabilitaet.png', dpi=300, bbox_inches='tight')
-plt.show()
+plt.savefig('santander_variabilitaet.png', dpi=300, bbox_inches='tight', pil_kwargs=png_options)
+if show_plots:
+    plt.show()
+plt.close(fig)
 
 # === 5. Korrelationsanalyse ===
 fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(15, 12))
@@ -183,18 +231,25 @@ ax1.text(0.05, 0.95, f'Korrelation: {corr:.3f}', transform=ax1.transAxes,
          bbox=dict(boxstyle="round", facecolor='wheat', alpha=0.8))
 
 # Saisonale Temperatur
-seasons = {1: 'Winter', 2: 'Winter', 3: 'Frühling', 4: 'Frühling', 5: 'Frühling',
-          6: 'Sommer', 7: 'Sommer', 8: 'Sommer', 9: 'Herbst', 10: 'Herbst', 11: 'Herbst', 12: 'Winter'}
-monthly_data['season'] = monthly_data['month'].map(seasons)
-
-seasonal_temp = monthly_data.groupby('season')['t2m_mean_C'].mean()
+# Jahreszeit je Monat als Code-Array (Index = Monat) und geordnete Kategorie
+seasons = ['Winter', 'Frühling', 'Sommer', 'Herbst']
+season_codes = np.array([-1, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0])
+monthly_data['season'] = pd.Categorical.from_codes(
+    season_codes[monthly_data['month'].to_numpy()], categories=seasons, ordered=True)
+
+# Ein Grouper für beide Variablen; die geordnete Kategorie legt die Reihenfolge
+# Winter, Frühling, Sommer, Herbst fest (passend zur Farbliste unten)
+seasonal_means = monthly_data.groupby('season', sort=True, observed=True)[
+    ['t2m_mean_C', 'precip_total_mm']].mean()
+
+seasonal_temp = seasonal_means['t2m_mean_C']
 ax2.bar(seasonal_temp.index, seasonal_temp.values, color=['lightblue', 'lightgreen', 'gold', 'orange'])
 ax2.set_title('Saisonale Durchschnittstemperatur')
 ax2.set_ylabel('Temperatur (°C)')
 ax2.grid(True, alpha=0.3)
 
 # Saisonaler Niederschlag
-seasonal_precip = monthly_data.groupby('season')['precip_total_mm'].mean()
+seasonal_precip = seasonal_means['precip_total_mm']
 ax3.bar(seasonal_precip.index, seasonal_precip.values, color=['lightblue', 'lightgreen', 'gold', 'orange'])
 ax3.set_title('Saisonaler Durchschnittsniederschlag')
 ax3.set_ylabel('Niederschlag (mm)')
@@ -210,23 +265,34 @@ ax4.set_xlabel('Dekade')
 ax4.grid(True, alpha=0.3)
 
 plt.tight_layout()
-plt.savefig('santander_korrelationen.png', dpi=300, bbox_inches='tight')
-plt.show()
+plt.savefig('santander_korrelationen.png', dpi=300, bbox_inches='tight', pil_kwargs=png_options)
+if show_plots:
+    plt.show()
+plt.close(fig)
 
 # === Statistische Zusammenfassung ===
+# Extremwerte per nanargmin/nanargmax auf den numpy-Arrays (ein Durchlauf je
+# Extremum, fehlende Monate werden wie bei idxmin/idxmax übersprungen)
+year_arr = monthly_data['year'].to_numpy()
+month_arr = monthly_data['month'].to_numpy()
+t = monthly_data['t2m_mean_C'].to_numpy()
+t_imin, t_imax = np.nanargmin(t), np.nanargmax(t)
+pr = monthly_data['precip_total_mm'].to_numpy()
+pr_imin, pr_imax = np.nanargmin(pr), np.nanargmax(pr)
+
 print("\n=== KLIMASTATISTIK SANTANDER (1975-2024) ===")
-print(f"Zeitraum: {monthly_data['year'].min()}-{monthly_data['year'].max()} ({len(monthly_data)} Monate)")
+print(f"Zeitraum: {year_arr.min()}-{year_arr.max()} ({len(monthly_data)} Monate)")
 print(f"\nTemperatur:")
 print(f"  Mittelwert: {monthly_data['t2m_mean_C'].mean():.1f}°C")
-print(f"  Minimum: {monthly_data['t2m_mean_C'].min():.1f}°C ({monthly_data.loc[monthly_data['t2m_mean_C'].idxmin(), 'year']}/{monthly_data.loc[monthly_data['t2m_mean_C'].idxmin(), 'month']:02d})")
-print(f"  Maximum: {monthly_data['t2m_mean_C'].max():.1f}°C ({monthly_data.loc[monthly_data['t2m_mean_C'].idxmax(), 'year']}/{monthly_data.loc[monthly_data['t2m_mean_C'].idxmax(), 'month']:02d})")
-print(f"  Trend: {z[0]*10:.2f}°C pro Dekade")
+print(f"  Minimum: {t[t_imin]:.1f}°C ({year_arr[t_imin]}/{month_arr[t_imin]:02d})")
+print(f"  Maximum: {t[t_imax]:.1f}°C ({year_arr[t_imax]}/{month_arr[t_imax]:02d})")
+print(f"  Trend: {slope_t*10:.2f}°C pro Dekade")
 
 print(f"\nNiederschlag:")
 print(f"  Mittelwert: {monthly_data['precip_total_mm'].mean():.1f}mm/Monat")
 print(f"  Jahressumme (Mittel): {monthly_data['precip_total_mm'].mean()*12:.0f}mm")
-print(f"  Minimum: {monthly_data['precip_total_mm'].min():.1f}mm ({monthly_data.loc[monthly_data['precip_total_mm'].idxmin(), 'year']}/{monthly_data.loc[monthly_data['precip_total_mm'].idxmin(), 'month']:02d})")
-print(f"  Maximum: {monthly_data['precip_total_mm'].max():.1f}mm ({monthly_data.loc[monthly_data['precip_total_mm'].idxmax(), 'year']}/{monthly_data.loc[monthly_data['precip_total_mm'].idxmax(), 'month']:02d})")
+print(f"  Minimum: {pr[pr_imin]:.1f}mm ({year_arr[pr_imin]}/{month_arr[pr_imin]:02d})")
+print(f"  Maximum: {pr[pr_imax]:.1f}mm ({year_arr[pr_imax]}/{month_arr[pr_imax]:02d})")
 
 print("\nDiagramme wurden erstellt:")
 print("  - santander_zeitreihen.png")